@@ -1,65 +1,272 @@
+import asyncio
+import copy
+import logging
+import struct
 import time
-from pymodbus.client import ModbusSerialClient
-from pymodbus.exceptions import ModbusException
+from pymodbus import FramerType
+from pymodbus.client import AsyncModbusSerialClient
+from pymodbus.exceptions import ModbusException, ModbusIOException
 
-class LaSpazialeCoffeeMachine:
-    def __init__(self, port='/dev/ttyUSB0', baudrate=9600):
+log = logging.getLogger(__name__)
+
+# Group selection register bits (b00-b07), see get_group_selection()
+_SELECTION_FLAGS = (
+    ('single_short', 0x01),
+    ('single_long', 0x02),
+    ('double_short', 0x04),
+    ('double_long', 0x08),
+    ('continuous_flow', 0x10),
+    ('single_medium', 0x20),
+    ('double_medium', 0x40),
+    ('purge', 0x80),
+)
+# Decoded selection dict for every value of the low byte (b08-b15 are always zero)
+_SELECTION_TABLE = [{name: bool(i & mask) for name, mask in _SELECTION_FLAGS} for i in range(256)]
+
+class AsyncLaSpazialeCoffeeMachine:
+    # Group 0 identifying registers 0-11: serial (0-9), model (10), firmware (11)
+    IDENTITY_BASE = 0
+    IDENTITY_COUNT = 12
+    # Group 1 state registers 256-270 (HEX 0x100-0x10E), read as one block
+    STATE_BASE = 256
+    STATE_COUNT = 15
+    # Register address per group number (index 0 unused, groups are 1-3)
+    _STATUS_ADDR = (None, 256, 257, 258)  # Group selection (HEX 0x100-0x102)
+    _FAULT_ADDR = (None, 260, 261, 262)  # Volumetric sensor fault
+    _PURGE_ADDR = (None, 264, 265, 266)  # Purge countdown
+    _CMD_ADDR = (None, 512, 513, 514)  # Delivery command (HEX 0x200-0x202)
+    # Delivery command register values, see send_coffee_command()
+    COMMAND_MAP = {
+        'single_short': 1,
+        'single_long': 2,
+        'double_short': 4,
+        'double_long': 8,
+        'single_medium': 32,
+        'double_medium': 64,
+        'stop': 128,
+        'purge': 256,
+    }
+    # Group selection register bits (name, mask), shared with the decode table
+    SELECTION_FLAGS = _SELECTION_FLAGS
+    # Failed reads in a row before a wait loop gives up (single lost frames are retried)
+    MAX_POLL_ERRORS = 3
+    # A free group is held back while its automatic purge is due within this many
+    # seconds (0 included), so a delivery is not started just before the purge
+    PURGE_GUARD_S = 60
+
+    def __init__(self, port='/dev/ttyUSB0', baudrate=9600, cache_ttl=0.1, timeout=0.25, retries=0, keep_open=False):
         """
         Initialize connection to LaSpaziale S50-QSS Robot
         
         Args:
             port: Serial port (e.g., 'COM4 or 'COM3' on Windows, '/dev/ttyUSB0' on Linux)
             baudrate: Communication speed (9600 bps as per spec)
+            cache_ttl: Seconds a state block read is reused by the getters (0 disables)
+            timeout: Seconds to wait for a response (the largest reply, 15 registers,
+                takes about 40ms on the wire at 9600 bps)
+            retries: Times pymodbus resends a request that got no response
+                (the wait loops re-read on their next check, see MAX_POLL_ERRORS)
+            keep_open: Leave the serial port open when an async with block exits, so the
+                next block reuses it (call disconnect() to close it)
         """
-        self.client = ModbusSerialClient(
-            # method='rtu',
+        # The async transport reads as soon as the port has data (a 0.5ms poll on Windows),
+        # so unlike the sync client there is no _recv_interval sleep to tune for 9600 bps
+        self.client = AsyncModbusSerialClient(
             port=port,
+            framer=FramerType.RTU,
             baudrate=baudrate,
             bytesize=8,
             parity='N',
             stopbits=1,
-            timeout=1
+            timeout=timeout,
+            retries=retries,
+            # No background reconnect task: ensure_connected() reopens the port on demand,
+            # and two reconnect paths would open it twice
+            reconnect_delay=0
         )
         self.node_address = 1  # 0x01 as per spec
+        self._read_cache = {}  # (address, count) -> (time.monotonic(), registers), see _read_cached()
+        self._write_gen = 0  # Bumped when a write starts and ends, see _read_cached()
+        self._state_regs = None  # Last state block read by refresh_state(), kept across writes for busy_mask
+        self._cache_ttl = cache_ttl
+        self._identity_cache = {}  # Values fixed for the life of the board (serial, firmware, groups)
+        self._last_snapshot = None  # Last get_full_status() result
+        self._last_snapshot_ts = 0.0  # time.monotonic() of _last_snapshot, for max_age_s
+        self._connected = False  # Set by connect(), cleared by disconnect()
+        self._keep_open = keep_open
+        self._connect_lock = asyncio.Lock()  # One reconnect at a time when requests run concurrently
         
-    def connect(self):
-        """Establish connection to the coffee machine"""
-        return self.client.connect()
+    async def __aenter__(self):
+        """Connect when entering an async with block (check client.connected for the result)"""
+        await self.connect()
+        return self
+    
+    async def __aexit__(self, *exc):
+        """Close the connection when leaving an async with block, even on error, unless keep_open"""
+        if not self._keep_open:
+            await self.disconnect()
+    
+    async def connect(self):
+        """Establish connection to the coffee machine (does nothing if already open)"""
+        if self._connected and self.client.connected:
+            return True
+        self._connected = await self.client.connect()
+        return self._connected
     
-    def disconnect(self):
-        """Close connection"""
+    async def disconnect(self):
+        """Close connection (does nothing if already closed)"""
+        if not self._connected:
+            return
+        self._connected = False
         self.client.close()
     
-    # Group 0: Identifying Functions
-    def get_serial_number(self):
-        """Read board serial number (20 chars)"""
+    async def ensure_connected(self):
+        """
+        Reconnect if the serial link is not open (e.g. after a USB drop)
+        Returns True if connected, False if error
+        """
+        if self._connected and self.client.connected:
+            return True
+        async with self._connect_lock:
+            # Another request may have reconnected while this one waited,
+            # in which case connect() returns at once
+            if self._connected and not self.client.connected:
+                log.warning("Connection lost, reconnecting")
+            if not await self.connect():
+                log.warning("Unable to connect to the coffee machine")
+                return False
+            return True
+    
+    async def _read_registers(self, address, count):
+        """
+        Read count holding registers starting at address in one request
+        Returns list of register values, None if error
+        """
+        if not await self.ensure_connected():
+            return None
         try:
-            result = self.client.read_holding_registers(address=0, count=10)
-            if result.isError():
-                return None
-            # Convert registers to string (each register = 2 chars)
-            serial = ''.join([chr(reg >> 8) + chr(reg & 0xFF) for reg in result.registers])
-            return serial.rstrip('\x00')  # Remove null terminators
-        except Exception as e:
-            print(f"Error reading serial number: {e}")
+            result = await self.client.read_holding_registers(address, count=count)
+        except ModbusIOException as exc:
+            # No (valid) response, routine with retries=0: callers re-read on their next check
+            log.warning("No response reading %d register(s) at %d: %s", count, address, exc)
+            return None
+        except (ModbusException, OSError):
+            log.exception("Error reading %d register(s) at %d", count, address)
             return None
+        if result.isError():
+            return None
+        return result.registers
     
-    def get_firmware_version(self):
-        """Read firmware version"""
+    async def _read_cached(self, address, count, ttl):
+        """
+        Read count holding registers at address, reusing a read of the same
+        range that is less than ttl seconds old (0 always reads)
+        Returns list of register values, None if error
+        """
+        entry = self._read_cache.get((address, count))
+        if entry is not None and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        
+        write_gen = self._write_gen
+        regs = await self._read_registers(address, count)
+        # A write that overlapped the read may have changed the registers after they were sent
+        if regs is not None and write_gen == self._write_gen:
+            self._read_cache[(address, count)] = (time.monotonic(), regs)
+        return regs
+    
+    async def _write_register(self, address, value):
+        """
+        Write value to the holding register at address
+        Returns True if successful, False if error
+        """
+        # Commands change the machine state, so no cached read may outlive a write,
+        # including reads still in flight when it starts or ends
+        self._read_cache.clear()
+        self._last_snapshot = None
+        self._write_gen += 1
         try:
-            result = self.client.read_holding_registers(address=11, count=1)
-            if result.isError():
-                return None
-            reg = result.registers[0]
-            major = (reg >> 8) & 0xFF
-            minor = reg & 0xFF
-            return f"{major}.{minor}"
-        except Exception as e:
-            print(f"Error reading firmware version: {e}")
+            if not await self.ensure_connected():
+                return False
+            try:
+                result = await self.client.write_register(address, value)
+            except (ModbusException, OSError):
+                log.exception("Error writing %d to register %d", value, address)
+                return False
+            return not result.isError()
+        finally:
+            self._write_gen += 1
+    
+    # Group 0: Identifying Functions
+    async def read_identity(self):
+        """
+        Read the identifying block (registers 0-11) in one request
+        Returns list of 12 register values, None if error
+        """
+        return await self._read_registers(self.IDENTITY_BASE, self.IDENTITY_COUNT)
+    
+    def invalidate_identity_cache(self):
+        """Forget the cached serial number, firmware version and number of groups"""
+        self._identity_cache.clear()
+    
+    @staticmethod
+    def _decode_string(regs):
+        """Convert registers to string (each register = 2 chars, high byte first), without null terminators"""
+        return struct.pack(f'>{len(regs)}H', *regs).decode('latin-1').rstrip('\x00')
+    
+    async def _load_identity(self):
+        """
+        Fill the serial number and firmware version cache from one identity block read
+        Returns True if successful, False if error
+        """
+        regs = await self.read_identity()
+        if regs is None:
+            return False
+        self._identity_cache.setdefault('serial', self._decode_string(regs[0:10]))
+        reg = regs[11]
+        major = (reg >> 8) & 0xFF
+        minor = reg & 0xFF
+        self._identity_cache.setdefault('firmware', f"{major}.{minor}")
+        return True
+    
+    async def get_serial_number(self):
+        """Read board serial number (20 chars), cached after the first successful read"""
+        if 'serial' not in self._identity_cache and not await self._load_identity():
+            return None
+        return self._identity_cache['serial']
+    
+    async def get_firmware_version(self):
+        """Read firmware version, cached after the first successful read"""
+        if 'firmware' not in self._identity_cache and not await self._load_identity():
             return None
+        return self._identity_cache['firmware']
     
     # Group 1: Coffee Machine State Functions
-    def get_group_selection(self, group_num):
+    async def refresh_state(self, force=False):
+        """
+        Read the whole machine state block (registers 256-270) in one request
+        
+        Covers group selection (256-258), sensor faults (260-262),
+        purge countdowns (264-266), machine block (269) and number of groups (270).
+        A block read less than cache_ttl seconds ago is returned without a new
+        request unless force is True.
+        Returns list of 15 register values, None if error
+        """
+        ttl = 0 if force else self._cache_ttl
+        regs = await self._read_cached(self.STATE_BASE, self.STATE_COUNT, ttl)
+        if regs is not None:
+            self._state_regs = regs
+        return regs
+    
+    @staticmethod
+    def decode_selection(status):
+        """
+        Decode a raw group selection register value (e.g. from read_all_groups_status)
+        Returns dict {flag name: bool} for the SELECTION_FLAGS bits
+        """
+        # Copy so callers can't modify the shared table entry
+        return dict(_SELECTION_TABLE[status & 0xFF])
+    
+    async def get_group_selection(self, group_num):
         """
         Get current selection/delivery status for a group (1-3)
         Returns dict with coffee types being delivered
@@ -67,84 +274,133 @@ class LaSpazialeCoffeeMachine:
         if group_num < 1 or group_num > 3:
             raise ValueError("Group number must be 1-3")
         
-        register_addr = 256 + (group_num - 1)  # Groups status starts at register 256 (HEX 0x100)
+        register_addr = self._STATUS_ADDR[group_num]
         
-        try:
-            result = self.client.read_holding_registers(register_addr, count=1)
-            if result.isError():
-                return None
-            
-            status = result.registers[0]
-            return {
-                'single_short': bool(status & 0x01),
-                'single_long': bool(status & 0x02),
-                'double_short': bool(status & 0x04),
-                'double_long': bool(status & 0x08),
-                'continuous_flow': bool(status & 0x10),
-                'single_medium': bool(status & 0x20),
-                'double_medium': bool(status & 0x40),
-                'purge': bool(status & 0x80)
-            }
-        except Exception as e:
-            print(f"Error reading group {group_num} selection: {e}")
+        regs = await self.refresh_state()
+        if regs is None:
             return None
+        
+        status = regs[register_addr - self.STATE_BASE]
+        return self.decode_selection(status)
     
-    def get_sensor_fault(self, group_num):
+    async def get_sensor_fault(self, group_num):
         """Check if volumetric sensor has fault for group (1-3)"""
         if group_num < 1 or group_num > 3:
             raise ValueError("Group number must be 1-3")
         
-        register_addr = 260 + (group_num - 1)  # Sensor faults start at 260
+        register_addr = self._FAULT_ADDR[group_num]
         
-        try:
-            result = self.client.read_holding_registers(register_addr, count=1)
-            if result.isError():
-                return None
-            return result.registers[0] == 1
-        except Exception as e:
-            print(f"Error reading sensor fault for group {group_num}: {e}")
+        regs = await self.refresh_state()
+        if regs is None:
             return None
+        return regs[register_addr - self.STATE_BASE] == 1
     
-    def get_purge_countdown(self, group_num):
+    async def get_purge_countdown(self, group_num):
         """Get seconds until automatic purge for group (1-3)"""
         if group_num < 1 or group_num > 3:
             raise ValueError("Group number must be 1-3")
         
-        register_addr = 264 + (group_num - 1)  # Purge countdown starts at 264
+        register_addr = self._PURGE_ADDR[group_num]
         
-        try:
-            result = self.client.read_holding_registers(register_addr, count=1)
-            if result.isError():
-                return None
-            return result.registers[0]
-        except Exception as e:
-            print(f"Error reading purge countdown for group {group_num}: {e}")
+        regs = await self.refresh_state()
+        if regs is None:
             return None
+        return regs[register_addr - self.STATE_BASE]
     
-    def is_machine_blocked(self):
+    async def is_machine_blocked(self):
         """Check if coffee machine is blocked"""
-        try:
-            result = self.client.read_holding_registers(address=269, count=1)
-            if result.isError():
-                return None
-            return result.registers[0] == 1
-        except Exception as e:
-            print(f"Error reading machine block status: {e}")
+        regs = await self.refresh_state()
+        if regs is None:
             return None
+        return regs[269 - self.STATE_BASE] == 1
     
-    def get_number_of_groups(self):
-        """Get total number of groups present"""
-        try:
-            result = self.client.read_holding_registers(address=270, count=1)
-            if result.isError():
-                return None
-            return result.registers[0]
-        except Exception as e:
-            print(f"Error reading number of groups: {e}")
+    async def get_number_of_groups(self):
+        """Get total number of groups present, cached after the first successful read"""
+        if 'num_groups' in self._identity_cache:
+            return self._identity_cache['num_groups']
+        regs = await self.refresh_state()
+        if regs is None:
+            return None
+        return self._identity_cache.setdefault('num_groups', regs[270 - self.STATE_BASE])
+    
+    def _decode_groups(self, regs, num_groups):
+        """Decode the per-group fields of a state block into a list of dicts, one per group"""
+        groups = []
+        for group_num in range(1, min(num_groups, 3) + 1):
+            status = regs[self._STATUS_ADDR[group_num] - self.STATE_BASE]
+            groups.append({
+                'group': group_num,
+                'busy': (status & 0xFF) != 0,
+                'selection': self.decode_selection(status),
+                'sensor_fault': regs[self._FAULT_ADDR[group_num] - self.STATE_BASE] == 1,
+                'purge_countdown': regs[self._PURGE_ADDR[group_num] - self.STATE_BASE],
+            })
+        return groups
+    
+    async def get_full_status(self, max_age_s=None):
+        """
+        Get machine and per-group state from one state block read (256-270)
+        
+        Args:
+            max_age_s: If set, return the last snapshot without touching the bus
+                       when it is at most this many seconds old (any write discards it)
+        
+        Returns:
+            dict {'groups': [{'group', 'busy', 'selection', 'sensor_fault', 'purge_countdown'}, ...],
+                  'blocked': bool, 'num_groups': int, 'timestamp': time.time() of the read},
+            None if error
+        """
+        snapshot = self._last_snapshot
+        if (max_age_s is not None and snapshot is not None
+                and time.monotonic() - self._last_snapshot_ts <= max_age_s):
+            # Copy so callers can't modify the cached snapshot
+            return copy.deepcopy(snapshot)
+        
+        write_gen = self._write_gen
+        regs = await self.refresh_state()
+        if regs is None:
+            return None
+        
+        num_groups = regs[270 - self.STATE_BASE]
+        snapshot = {
+            'groups': self._decode_groups(regs, num_groups),
+            'blocked': regs[269 - self.STATE_BASE] == 1,
+            'num_groups': num_groups,
+            'timestamp': time.time(),
+        }
+        # Like the read cache, keep no snapshot of a read that overlapped a write
+        if write_gen == self._write_gen:
+            self._last_snapshot = copy.deepcopy(snapshot)
+            self._last_snapshot_ts = time.monotonic()
+        return snapshot
+    
+    def _present_groups(self, regs):
+        """Number of groups present (1-3) according to register 270 of a state block"""
+        return min(regs[270 - self.STATE_BASE], 3)
+    
+    async def read_all_groups_status(self):
+        """
+        Get the raw status register (256-258) of every group at once
+        Returns tuple of one value per group present (group 1 first), None if error
+        """
+        regs = await self.refresh_state()
+        if regs is None:
+            return None
+        return tuple(regs[0:self._present_groups(regs)])
+    
+    @property
+    def busy_mask(self):
+        """
+        Busy flag of every group present from the last state block read (no new request)
+        Returns tuple of one bool per group present (group 1 first), None if the state was never read
+        """
+        regs = self._state_regs
+        if regs is None:
             return None
+        return tuple((status & 0xFF) != 0 for status in regs[0:self._present_groups(regs)])
     
     # Group 2: Command Functions
-    def send_coffee_command(self, group_num, command):
+    async def send_coffee_command(self, group_num, command):
         """
         Send coffee delivery command to group (1-3)
         
@@ -162,48 +418,71 @@ class LaSpazialeCoffeeMachine:
         if group_num < 1 or group_num > 3:
             raise ValueError("Group number must be 1-3")
         
-        register_addr = 512 + (group_num - 1) 
+        register_addr = self._CMD_ADDR[group_num]
         
-        try:
-            result = self.client.write_register(register_addr, command)
-            return not result.isError()
-        except Exception as e:
-            print(f"Error sending command to group {group_num}: {e}")
-            return False
+        return await self._write_register(register_addr, command)
+    
+    async def command_groups(self, cmds):
+        """
+        Send commands to several groups concurrently
+        
+        Args:
+            cmds: dict {group_num: command}, command values as in send_coffee_command()
+        
+        Returns:
+            dict {group_num: True if successful, False if error}
+        """
+        for group_num in cmds:
+            if group_num < 1 or group_num > 3:
+                raise ValueError("Group number must be 1-3")
+        
+        # pymodbus queues the requests so only one is on the RS-485 bus at a time
+        results = await asyncio.gather(*(self.send_coffee_command(group_num, command)
+                                         for group_num, command in cmds.items()))
+        return dict(zip(cmds, results))
     
-    def deliver_single_short(self, group_num):
+    async def deliver(self, group_num, kind):
+        """
+        Send the command named kind (a COMMAND_MAP key, e.g. 'single_short' or 'purge') to group (1-3)
+        Returns True if successful, False if error
+        """
+        if kind not in self.COMMAND_MAP:
+            raise ValueError(f"Unknown command kind: {kind!r}")
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP[kind])
+    
+    async def deliver_single_short(self, group_num):
         """Deliver single short coffee"""
-        return self.send_coffee_command(group_num, 1)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['single_short'])
     
-    def deliver_single_long(self, group_num):
+    async def deliver_single_long(self, group_num):
         """Deliver single long coffee"""
-        return self.send_coffee_command(group_num, 2)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['single_long'])
     
-    def deliver_double_short(self, group_num):
+    async def deliver_double_short(self, group_num):
         """Deliver double short coffee"""
-        return self.send_coffee_command(group_num, 4)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['double_short'])
     
-    def deliver_double_long(self, group_num):
+    async def deliver_double_long(self, group_num):
         """Deliver double long coffee"""
-        return self.send_coffee_command(group_num, 8)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['double_long'])
     
-    def deliver_single_medium(self, group_num):
+    async def deliver_single_medium(self, group_num):
         """Deliver single medium coffee"""
-        return self.send_coffee_command(group_num, 32)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['single_medium'])
     
-    def deliver_double_medium(self, group_num):
+    async def deliver_double_medium(self, group_num):
         """Deliver double medium coffee"""
-        return self.send_coffee_command(group_num, 64)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['double_medium'])
     
-    def stop_delivery(self, group_num):
+    async def stop_delivery(self, group_num):
         """Stop ongoing delivery"""
-        return self.send_coffee_command(group_num, 128)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['stop'])
     
-    def start_purge(self, group_num):
+    async def start_purge(self, group_num):
         """Start purge cycle"""
-        return self.send_coffee_command(group_num, 256)
+        return await self.send_coffee_command(group_num, self.COMMAND_MAP['purge'])
     
-    def is_group_busy(self, group_num):
+    async def is_group_busy(self, group_num):
         """
         Check if a group is busy (has an ongoing delivery)
         Returns True if busy, False if free, None if error
@@ -212,208 +491,304 @@ class LaSpazialeCoffeeMachine:
             raise ValueError("Group number must be 1-3")
         
         # According to documentation, group status is in registers 256-258 (HEX 100-102)
-        register_addr = 256 + (group_num - 1)  # Base address 256 (HEX 0x100) for group 1
+        register_addr = self._STATUS_ADDR[group_num]
         
-        try:
-            result = self.client.read_holding_registers(register_addr, count=1)
-            if result.isError():
-                return None
-            
-            status = result.registers[0]
-            # Print status value for debugging
-            print(f"Group {group_num} status register value: {status} (0x{status:04X})")
-            
-            # According to documentation, bits 0-7 indicate if a delivery is in progress
-            # Check only the relevant bits (0-7) for coffee delivery
-            delivery_mask = 0xFF  # Bits 0-7
-            is_busy = (status & delivery_mask) != 0
-            
-            return is_busy
-        except Exception as e:
-            print(f"Error checking if group {group_num} is busy: {e}")
+        regs = await self.refresh_state()
+        if regs is None:
             return None
+        
+        status = regs[register_addr - self.STATE_BASE]
+        log.debug("Group %d status register value: %d (0x%04X)", group_num, status, status)
+        
+        # According to documentation, bits 0-7 indicate if a delivery is in progress
+        # Check only the relevant bits (0-7) for coffee delivery
+        delivery_mask = 0xFF  # Bits 0-7
+        is_busy = (status & delivery_mask) != 0
+        
+        return is_busy
     
-    def wait_until_group_is_free(self, group_num, timeout=30, check_interval=1.0):
+    async def wait_until_group_is_free(self, group_num, timeout=30, check_interval=0.5, on_busy=None):
         """
         Wait until the group is free (not busy with any delivery)
         
+        Checks start 0.05s apart and back off exponentially while the group
+        stays busy, so short deliveries are detected quickly and long ones
+        don't load the bus. A free group whose automatic purge is due within
+        PURGE_GUARD_S seconds (purge countdown near zero, see spec) is not
+        reported as free.
+        
         Args:
             group_num: Group number (1-3)
             timeout: Maximum time to wait in seconds
-            check_interval: How often to check in seconds
+            check_interval: Longest delay between two checks in seconds
+            on_busy: Optional callback on_busy(group_num, status) called on every busy check
+        
+        A failed read counts as busy; the wait only gives up early after
+        MAX_POLL_ERRORS failed reads in a row.
         
         Returns:
             True if group became free within timeout, False otherwise
         """
-        start_time = time.time()
+        if group_num < 1 or group_num > 3:
+            raise ValueError("Group number must be 1-3")
+        
+        status_index = self._STATUS_ADDR[group_num] - self.STATE_BASE
+        countdown_index = self._PURGE_ADDR[group_num] - self.STATE_BASE
+        deadline = time.monotonic() + timeout
+        delay = min(0.05, check_interval)
+        errors = 0
         
-        while time.time() - start_time < timeout:
-            busy = self.is_group_busy(group_num)
+        while True:
+            # Busy bits and purge countdown come back in the same request
+            regs = await self.refresh_state(force=True)
+            if regs is None:
+                errors += 1
+                if errors >= self.MAX_POLL_ERRORS:
+                    log.warning("Error checking group %d status (%d failed reads)", group_num, errors)
+                    return False
+                busy = None
+            else:
+                errors = 0
+                busy = (regs[status_index] & 0xFF) != 0
+                countdown = regs[countdown_index]
+                if not busy and countdown > self.PURGE_GUARD_S:
+                    log.debug("Group %d is now free", group_num)
+                    return True
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             
             if busy is None:
-                print(f"Error checking group {group_num} status")
-                return False
+                # A lost or corrupted frame is retried on the next check
+                log.debug("Error checking group %d status, next check in %.2fs", group_num, delay)
+                pause = delay
+                delay = min(delay * 2, check_interval)
+            elif busy:
+                if on_busy is not None:
+                    on_busy(group_num, regs[status_index])
+                log.debug("Group %d is busy, next check in %.2fs", group_num, delay)
+                pause = delay
+                delay = min(delay * 2, check_interval)
+            else:
+                # Sleep until the purge is due, then poll for it to start and finish
+                pause = max(countdown, delay)
+                log.debug("Group %d automatic purge in %ds, next check in %.2fs", group_num, countdown, pause)
+                delay = min(delay * 2, check_interval)
+            await asyncio.sleep(min(pause, remaining))
+        
+        log.warning("Timeout waiting for group %d to become free", group_num)
+        return False
+    
+    async def wait_until_any_group_free(self, groups=None, timeout=30, check_interval=0.5):
+        """
+        Wait until any of the given groups is free, with one state block read per check
+        
+        Uses the same backoff, imminent-purge rule and read error handling as
+        wait_until_group_is_free().
+        
+        Args:
+            groups: Group numbers (1-3) to watch, defaults to every group present;
+                    groups the machine does not report (register 270) are skipped
+            timeout: Maximum time to wait in seconds
+            check_interval: Longest delay between two checks in seconds
+        
+        Returns:
+            Number of the first free group, None if none became free within timeout
+            or after MAX_POLL_ERRORS failed reads in a row, None if none of the groups is present
+        """
+        if groups is not None:
+            groups = tuple(groups)
+            if not groups:
+                raise ValueError("At least one group is required")
+            for group_num in groups:
+                if group_num < 1 or group_num > 3:
+                    raise ValueError("Group number must be 1-3")
+        label = groups or "(all present)"  # For log messages
+        
+        deadline = time.monotonic() + timeout
+        delay = min(0.05, check_interval)
+        errors = 0
+        
+        while True:
+            regs = await self.refresh_state(force=True)
+            if regs is None:
+                errors += 1
+                if errors >= self.MAX_POLL_ERRORS:
+                    log.warning("Error checking status of groups %s (%d failed reads)", label, errors)
+                    return None
+            else:
+                errors = 0
+                present = self._present_groups(regs)
+                watched = [group_num for group_num in (groups or range(1, 4)) if group_num <= present]
+                if not watched:
+                    log.warning("None of groups %s is present (machine has %d)", label, present)
+                    return None
+                for group_num in watched:
+                    busy = (regs[self._STATUS_ADDR[group_num] - self.STATE_BASE] & 0xFF) != 0
+                    countdown = regs[self._PURGE_ADDR[group_num] - self.STATE_BASE]
+                    if not busy and countdown > self.PURGE_GUARD_S:
+                        log.debug("Group %d is now free", group_num)
+                        return group_num
             
-            if not busy:
-                print(f"Group {group_num} is now free")
-                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             
-            print(f"Group {group_num} is busy, waiting...")
-            time.sleep(check_interval)
+            if regs is None:
+                # A lost or corrupted frame is retried on the next check
+                log.debug("Error checking status of groups %s, next check in %.2fs", label, delay)
+            else:
+                log.debug("Groups %s are busy, next check in %.2fs", label, delay)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, check_interval)
         
-        print(f"Timeout waiting for group {group_num} to become free")
-        return False
+        log.warning("Timeout waiting for any of groups %s to become free", label)
+        return None
     
-    def send_water_command(self, set_num):
+    async def send_water_command(self, set_num):
         """
         Send water delivery command
         set_num: 1 for SET 1, 2 for SET 2, 0 to stop
         """
-        try:
-            result = self.client.write_register(516, set_num)
-            return not result.isError()
-        except Exception as e:
-            print(f"Error sending water command: {e}")
-            return False
+        return await self._write_register(516, set_num)
     
-    def send_mat_command(self, set_num):
+    async def send_mat_command(self, set_num):
         """
         Send MAT delivery command
         set_num: 1 for SET 1, 2 for SET 2, 0 to stop
         """
-        try:
-            result = self.client.write_register(517, set_num)
-            return not result.isError()
-        except Exception as e:
-            print(f"Error sending MAT command: {e}")
-            return False
+        return await self._write_register(517, set_num)
 
 # Example usage
-def main():
-    # Initialize coffee machine (adjust port as needed)
-    coffee_machine = LaSpazialeCoffeeMachine(port='COM4')  # Windows
-    # coffee_machine = LaSpazialeCoffeeMachine(port='/dev/ttyUSB0')  # Linux
-    
-    if not coffee_machine.connect():
-        print("Failed to connect to coffee machine")
-        return
-    
-    try:
-        # Read machine info
-        print("=== Machine Information ===")
-        serial = coffee_machine.get_serial_number()
-        print(f"Serial Number: {serial}")
-        
-        firmware = coffee_machine.get_firmware_version()
-        print(f"Firmware Version: {firmware}")
-        
-        num_groups = coffee_machine.get_number_of_groups()
-        print(f"Number of Groups: {num_groups}")
-        
-        blocked = coffee_machine.is_machine_blocked()
-        print(f"Machine Blocked: {blocked}")
-        
-        # Choose a group to use for coffee delivery
-        group_to_use = 2  # Using group 2
-        
-        # Check initial status of all groups
-        print("\n=== Initial Group Status ===")
-        for group in range(1, num_groups + 1 if num_groups else 4):
-            selection = coffee_machine.get_group_selection(group)
-            fault = coffee_machine.get_sensor_fault(group)
-            countdown = coffee_machine.get_purge_countdown(group)
-            
-            print(f"Group {group}:")
-            print(f"  Current Selection: {selection}")
-            print(f"  Sensor Fault: {fault}")
-            print(f"  Purge Countdown: {countdown}s")
+async def main():
+    # Initialize coffee machine (adjust port as needed); the port is closed when the block exits
+    # async with AsyncLaSpazialeCoffeeMachine(port='/dev/ttyUSB0') as coffee_machine:  # Linux
+    async with AsyncLaSpazialeCoffeeMachine(port='COM4') as coffee_machine:  # Windows
+        if not coffee_machine.client.connected:
+            log.error("Failed to connect to coffee machine")
+            return
         
-        # Read the status register directly to see what it contains
-        print("\n=== Direct Register Reading ===")
         try:
-            for reg_type, base_addr in [('Status', 256), ('Command', 512)]:
-                print(f"\n{reg_type} Registers:")
-                for i in range(3):  # Read for groups 1-3
-                    addr = base_addr + i
-                    result = coffee_machine.client.read_holding_registers(addr, count=1)
-                    if not result.isError():
-                        value = result.registers[0]
-                        print(f"  Register {addr} (Group {i+1}): {value} (0x{value:04X})")
-                    else:
-                        print(f"  Error reading register {addr}")
-        except Exception as e:
-            print(f"Error during register reading: {e}")
-        
-        # Test sequence: Start purge -> wait for completion -> deliver coffee
-        print("\n=== Coffee Delivery Test ===")
-        
-        # First check if group is busy before starting
-        busy_before = coffee_machine.is_group_busy(group_to_use)
-        print(f"Group {group_to_use} busy before starting: {busy_before}")
-        
-        # Send purge command
-        print(f"Sending purge command to group {group_to_use}...")
-        purge_result = coffee_machine.start_purge(group_to_use)
-        print(f"Purge command sent: {purge_result}")
-        
-        # Wait a moment and check status
-        print("Waiting 2 seconds...")
-        time.sleep(2)
-        busy_after_purge = coffee_machine.is_group_busy(group_to_use)
-        print(f"Group {group_to_use} busy after purge command: {busy_after_purge}")
-        
-        # Read status register directly
-        status_addr = 256 + (group_to_use - 1)
-        try:
-            result = coffee_machine.client.read_holding_registers(status_addr, count=1)
-            if not result.isError():
-                value = result.registers[0]
-                print(f"Status register {status_addr} after purge: {value} (0x{value:04X})")
-                print(f"Bits set: {''.join(['1' if (value & (1 << i)) else '0' for i in range(15, -1, -1)])}")
-        except Exception as e:
-            print(f"Error reading status register: {e}")
-        
-        # Wait for purge to complete
-        print("Waiting for purge to complete...")
-        if coffee_machine.wait_until_group_is_free(group_to_use, timeout=30):
-            print(f"Group {group_to_use} is now free after purge")
+            # Read machine info
+            print("=== Machine Information ===")
+            serial = await coffee_machine.get_serial_number()
+            print(f"Serial Number: {serial}")
+            
+            firmware = await coffee_machine.get_firmware_version()
+            print(f"Firmware Version: {firmware}")
+            
+            # One read for machine and group state
+            status = await coffee_machine.get_full_status()
+            if status is None:
+                log.error("Error reading machine status")
+            else:
+                print(f"Number of Groups: {status['num_groups']}")
+                print(f"Machine Blocked: {status['blocked']}")
+            
+            # Choose a group to use for coffee delivery
+            group_to_use = 2  # Using group 2
+            
+            # Check initial status of all groups
+            print("\n=== Initial Group Status ===")
+            for info in (status or {}).get('groups', []):
+                print(f"Group {info['group']}:")
+                print(f"  Busy: {info['busy']}")
+                print(f"  Current Selection: {info['selection']}")
+                print(f"  Sensor Fault: {info['sensor_fault']}")
+                print(f"  Purge Countdown: {info['purge_countdown']}s")
+            
+            # Read the status register directly to see what it contains
+            print("\n=== Direct Register Reading ===")
+            try:
+                for reg_type, base_addr in [('Status', 256), ('Command', 512)]:
+                    print(f"\n{reg_type} Registers:")
+                    # One request for groups 1-3
+                    result = await coffee_machine.client.read_holding_registers(base_addr, count=3)
+                    if result.isError():
+                        log.error("Error reading registers %d-%d", base_addr, base_addr + 2)
+                        continue
+                    for i, value in enumerate(result.registers):
+                        print(f"  Register {base_addr + i} (Group {i+1}): {value} (0x{value:04X})")
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("%s bits (groups 1-3): %s", reg_type,
+                                  ' '.join(format(value, '016b') for value in result.registers))
+            except (ModbusException, OSError):
+                log.exception("Error during register reading")
             
-            # Send coffee command
-            print("Sending single long coffee command...")
-            coffee_machine.stop_delivery(group_to_use)
-            coffee_result = coffee_machine.deliver_single_long(group_to_use)
-            print(f"Coffee command sent: {coffee_result}")
+            # Test sequence: Start purge -> wait for completion -> deliver coffee
+            print("\n=== Coffee Delivery Test ===")
             
-            # Check if group is busy right after sending command
-            busy_after_coffee = coffee_machine.is_group_busy(group_to_use)
-            print(f"Group {group_to_use} busy after coffee command: {busy_after_coffee}")
+            # First check if group is busy before starting
+            busy_before = await coffee_machine.is_group_busy(group_to_use)
+            print(f"Group {group_to_use} busy before starting: {busy_before}")
+            
+            # Send purge command
+            print(f"Sending purge command to group {group_to_use}...")
+            purge_result = await coffee_machine.start_purge(group_to_use)
+            print(f"Purge command sent: {purge_result}")
+            
+            # Poll until the machine reports the purge (up to 2 seconds)
+            print("Waiting for the group to start the purge...")
+            for _ in range(20):
+                await asyncio.sleep(0.1)
+                busy_after_purge = await coffee_machine.is_group_busy(group_to_use)
+                if busy_after_purge:
+                    break
+            print(f"Group {group_to_use} busy after purge command: {busy_after_purge}")
             
             # Read status register directly
+            status_addr = 256 + (group_to_use - 1)
             try:
-                result = coffee_machine.client.read_holding_registers(status_addr, count=1)
+                result = await coffee_machine.client.read_holding_registers(status_addr, count=1)
                 if not result.isError():
                     value = result.registers[0]
-                    print(f"Status register {status_addr} after coffee command: {value} (0x{value:04X})")
-                    print(f"Bits set: {''.join(['1' if (value & (1 << i)) else '0' for i in range(15, -1, -1)])}")
-            except Exception as e:
-                print(f"Error reading status register: {e}")
-        else:
-            print(f"Warning: Group {group_to_use} did not become free within timeout period")
-        
-        # Final status check
-        print("\n=== Final Group Status ===")
-        selection = coffee_machine.get_group_selection(group_to_use)
-        print(f"Group {group_to_use} final status: {selection}")
+                    print(f"Status register {status_addr} after purge: {value} (0x{value:04X})")
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Bits set: %s", format(value, '016b'))
+            except (ModbusException, OSError):
+                log.exception("Error reading status register")
+            
+            # Wait for purge to complete
+            print("Waiting for purge to complete...")
+            if await coffee_machine.wait_until_group_is_free(group_to_use, timeout=30):
+                print(f"Group {group_to_use} is now free after purge")
+                
+                # Send coffee command (the group is free, so no stop command is needed first)
+                print("Sending single long coffee command...")
+                coffee_result = await coffee_machine.deliver_single_long(group_to_use)
+                print(f"Coffee command sent: {coffee_result}")
+                
+                # Check if group is busy right after sending command
+                busy_after_coffee = await coffee_machine.is_group_busy(group_to_use)
+                print(f"Group {group_to_use} busy after coffee command: {busy_after_coffee}")
+                
+                # Read status register directly
+                try:
+                    result = await coffee_machine.client.read_holding_registers(status_addr, count=1)
+                    if not result.isError():
+                        value = result.registers[0]
+                        print(f"Status register {status_addr} after coffee command: {value} (0x{value:04X})")
+                        if log.isEnabledFor(logging.DEBUG):
+                            log.debug("Bits set: %s", format(value, '016b'))
+                except (ModbusException, OSError):
+                    log.exception("Error reading status register")
+            else:
+                log.warning("Group %d did not become free within timeout period", group_to_use)
+            
+            # Final status check
+            print("\n=== Final Group Status ===")
+            selection = await coffee_machine.get_group_selection(group_to_use)
+            print(f"Group {group_to_use} final status: {selection}")
 
-    
-    finally:
-        coffee_machine.disconnect()
-        coffee_machine.client.close()
-        print("\n=== Coffee Delivery Completed ===")
+        
+        finally:
+            print("\n=== Coffee Delivery Completed ===")
 
 if __name__ == "__main__":
-    main()
+    # INFO keeps the per-check polling messages (DEBUG) switched off
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
     # TODO: add try catch block
-    # TODO: add logging
     # TODO: add command line arguments
     # TODO: add documentation
\ No newline at end of file